@@ -1,21 +1,60 @@
-from flask import Flask, render_template_string, request, redirect, url_for, session, flash, send_file
+from flask import Blueprint, Flask, Response, current_app, render_template, request, redirect, url_for, session, flash, send_file
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from jinja2 import DictLoader
 from datetime import date, datetime, timedelta
+from array import array
+from collections import OrderedDict
+from itertools import accumulate, groupby
+import gzip
 import sqlite3
 import os
 import shutil
+import threading
 import time
+import uuid
 
-app = Flask(__name__)
-app.secret_key = 'sua-chave-secreta-aqui-mude-em-producao'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+try:
+    import brotli
+except ImportError:  # brotli é opcional; sem ele as respostas saem só em gzip
+    brotli = None
 
-# Configuração do Flask-Login
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos na inicialização do banco
+    fcntl = None
+
+bp = Blueprint('contador', __name__)
+MAX_OPS_SYNC = 500  # Operações aceitas por chamada ao /api/sync
+MAX_DIAS_STATS = 3660  # Maior intervalo aceito pelo /api/stats (~10 anos)
+MAX_CACHE_STATS = 256  # Séries diárias do /api/stats mantidas em memória (~29 KB cada no máximo)
+MIN_BYTES_COMPRESSAO = 500  # Respostas menores que isso não compensam comprimir
+
+MAX_CACHE_RANKING = 64  # Rankings mantidos em memória
+
+# Bancos cujo schema já foi garantido neste processo
+_bancos_inicializados = set()
+_bancos_inicializados_lock = threading.Lock()
+
+# Configuração do Flask-Login (associado ao app em create_app)
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'contador.login'
+
+class Caches:
+    """Caches em memória de um app. Ficam em app.extensions (ver create_app) para
+    que apps com bancos diferentes no mesmo processo não compartilhem resultados"""
+    def __init__(self):
+        # LRU das séries diárias usadas pelo /api/stats; a versão dos dados na
+        # chave invalida entradas antigas
+        self.stats = OrderedDict()
+        self.stats_lock = threading.Lock()
+        # Rankings por (intervalo de datas, banco, usuários, versões dos meses)
+        self.ranking = {}
+        self.ranking_lock = threading.Lock()
+
+def caches():
+    return current_app.extensions['contador_caches']
 
 class User(UserMixin):
     def __init__(self, id, username):
@@ -24,7 +63,7 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    conn = sqlite3.connect('pasteis.db')
+    conn = conectar()
     c = conn.cursor()
     c.execute('SELECT id, username FROM users WHERE id = ?', (user_id,))
     user = c.fetchone()
@@ -33,8 +72,16 @@ def load_user(user_id):
         return User(user[0], user[1])
     return None
 
-def init_db():
-    conn = sqlite3.connect('pasteis.db')
+def caminho_banco():
+    return current_app.config['DATABASE']
+
+def conectar(**kwargs):
+    return sqlite3.connect(caminho_banco(), **kwargs)
+
+def init_db(novo_banco=False):
+    """Cria as tabelas e aplica migrações. novo_banco=True gera um novo
+    identificador, usado quando o arquivo do banco foi substituído"""
+    conn = conectar()
     c = conn.cursor()
     
     # Tabela de usuários
@@ -49,41 +96,314 @@ def init_db():
                   data TEXT NOT NULL,
                   quantidade INTEGER NOT NULL,
                   user_id INTEGER,
+                  versao INTEGER NOT NULL DEFAULT 0,
                   FOREIGN KEY (user_id) REFERENCES users (id))''')
-    
+
+    # Migração de bancos antigos: sequência de alterações por usuário (usada pelo /api/sync)
+    colunas = [row[1] for row in c.execute('PRAGMA table_info(pasteis)')]
+    if 'versao' not in colunas:
+        c.execute('ALTER TABLE pasteis ADD COLUMN versao INTEGER NOT NULL DEFAULT 0')
+        c.execute('UPDATE pasteis SET versao = 1')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_pasteis_user_versao ON pasteis (user_id, versao)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_pasteis_user_data ON pasteis (user_id, data)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_pasteis_data_user ON pasteis (data, user_id, quantidade)')
+
+    # Operações do /api/sync já aplicadas: reenvios (resposta perdida, duas abas)
+    # são reconhecidos pelo id que o cliente deu a cada operação
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_aplicadas
+                 (user_id INTEGER NOT NULL,
+                  cliente TEXT NOT NULL,
+                  op_id INTEGER NOT NULL,
+                  PRIMARY KEY (user_id, cliente, op_id)) WITHOUT ROWID''')
+
+    # Contador de alterações por mês ('AAAA-MM'), lido pelo cache do ranking:
+    # uma gravação só invalida rankings que incluem o mês da data gravada. Vale
+    # também para gravações de outros workers e do asgi.py
+    c.execute('''CREATE TABLE IF NOT EXISTS versao_mes
+                 (mes TEXT PRIMARY KEY,
+                  versao INTEGER NOT NULL) WITHOUT ROWID''')
+    c.execute('DROP TABLE IF EXISTS versao_global')
+
+    # Identificador do banco: muda quando o arquivo é trocado, para que clientes
+    # e caches não misturem dados (versões e ids de usuário recomeçam do zero)
+    c.execute('''CREATE TABLE IF NOT EXISTS metadados
+                 (chave TEXT PRIMARY KEY,
+                  valor TEXT NOT NULL)''')
+    c.execute('INSERT OR %s INTO metadados (chave, valor) VALUES (?, ?)' % ('REPLACE' if novo_banco else 'IGNORE'),
+             ('banco_id', uuid.uuid4().hex))
+
     conn.commit()
     conn.close()
 
 def get_quantidade(data):
     if not current_user.is_authenticated:
         return 0
-    conn = sqlite3.connect('pasteis.db')
+    conn = conectar()
     c = conn.cursor()
     c.execute('SELECT quantidade FROM pasteis WHERE data = ? AND user_id = ?', (data, current_user.id))
     result = c.fetchone()
     conn.close()
     return result[0] if result else 0
 
-def set_quantidade(data, quantidade):
+def ler_banco_id(c):
+    c.execute("SELECT valor FROM metadados WHERE chave = 'banco_id'")
+    return c.fetchone()[0]
+
+def get_banco_id():
+    conn = conectar()
+    banco_id = ler_banco_id(conn.cursor())
+    conn.close()
+    return banco_id
+
+def set_quantidade(data, quantidade, acao='set'):
     if not current_user.is_authenticated:
         return
-    conn = sqlite3.connect('pasteis.db')
+    conn = conectar(isolation_level=None)
     c = conn.cursor()
-    c.execute('SELECT id FROM pasteis WHERE data = ? AND user_id = ?', (data, current_user.id))
-    existing = c.fetchone()
-    
-    if existing:
-        c.execute('UPDATE pasteis SET quantidade = ? WHERE data = ? AND user_id = ?', 
-                 (quantidade, data, current_user.id))
-    else:
-        c.execute('INSERT INTO pasteis (data, quantidade, user_id) VALUES (?, ?, ?)', 
-                 (data, quantidade, current_user.id))
-    
-    conn.commit()
+    try:
+        # A trava de escrita vem antes de ler a versão e a quantidade atual: duas
+        # gravações simultâneas do mesmo usuário nunca recebem o mesmo número
+        # nem perdem um incremento
+        c.execute('BEGIN IMMEDIATE')
+        versao = proxima_versao(c, current_user.id)
+        quantidade = aplicar_operacao(c, current_user.id, data, acao, quantidade, versao)
+        c.execute('COMMIT')
+    except Exception:
+        c.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    return quantidade
+
+def proxima_versao(c, user_id):
+    """Próximo número da sequência de alterações do usuário"""
+    c.execute('SELECT COALESCE(MAX(versao), 0) + 1 FROM pasteis WHERE user_id = ?', (user_id,))
+    return c.fetchone()[0]
+
+def gravar_quantidade(c, user_id, data, quantidade, versao):
+    """Grava a quantidade do dia marcando a linha com a versão da transação"""
+    c.execute('UPDATE pasteis SET quantidade = ?, versao = ? WHERE data = ? AND user_id = ?',
+             (quantidade, versao, data, user_id))
+    if c.rowcount == 0:
+        c.execute('INSERT INTO pasteis (data, quantidade, user_id, versao) VALUES (?, ?, ?, ?)',
+                 (data, quantidade, user_id, versao))
+    incrementar_versao_mes(c, data)
+
+def aplicar_operacao(c, user_id, data, acao, quantidade, versao):
+    """Soma ('add') ou define ('set') a quantidade do dia, nunca abaixo de zero,
+    e devolve o valor gravado. Deve rodar dentro de uma transação BEGIN IMMEDIATE"""
+    if acao == 'add':
+        c.execute('SELECT quantidade FROM pasteis WHERE data = ? AND user_id = ?', (data, user_id))
+        atual = c.fetchone()
+        quantidade = (atual[0] if atual else 0) + quantidade
+    quantidade = max(quantidade, 0)
+    gravar_quantidade(c, user_id, data, quantidade, versao)
+    return quantidade
+
+def incrementar_versao_mes(c, data):
+    c.execute('''INSERT INTO versao_mes (mes, versao) VALUES (substr(?, 1, 7), 1)
+                 ON CONFLICT (mes) DO UPDATE SET versao = versao + 1''', (data,))
+
+def sincronizar(user_id, versao_cliente, ops, cliente=None, banco=None):
+    """Aplica um lote de operações numa única transação e devolve as linhas
+    alteradas desde a versão conhecida pelo cliente. Operações com id que já
+    foram aplicadas para o mesmo cliente são ignoradas; se o cliente conhece
+    outro banco, nada é aplicado e só o identificador atual é devolvido"""
+    conn = conectar(isolation_level=None)
+    c = conn.cursor()
+    try:
+        c.execute('BEGIN IMMEDIATE')
+        banco_id = ler_banco_id(c)
+        if banco is not None and banco != banco_id:
+            c.execute('ROLLBACK')
+            return {'banco': banco_id}
+        if ops:
+            versao = proxima_versao(c, user_id)
+            for op in ops:
+                if cliente is not None and op['id'] is not None:
+                    c.execute('INSERT OR IGNORE INTO sync_aplicadas (user_id, cliente, op_id) VALUES (?, ?, ?)',
+                             (user_id, cliente, op['id']))
+                    if c.rowcount == 0:
+                        continue
+                aplicar_operacao(c, user_id, op['data'], op['acao'], op['quantidade'], versao)
+        c.execute('''SELECT data, quantidade FROM pasteis
+                     WHERE user_id = ? AND versao > ? ORDER BY versao''',
+                  (user_id, versao_cliente))
+        alteracoes = c.fetchall()
+        c.execute('SELECT COALESCE(MAX(versao), 0) FROM pasteis WHERE user_id = ?', (user_id,))
+        versao_atual = c.fetchone()[0]
+        c.execute('COMMIT')
+    except Exception:
+        c.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    return {
+        'banco': banco_id,
+        'versao': versao_atual,
+        'alteracoes': [{'data': row[0], 'quantidade': row[1]} for row in alteracoes],
+    }
+
+def serie_diaria(c, user_id, d1, d2):
+    """Quantidades dia a dia entre d1 e d2 (inclusive), com zero nos dias sem registro"""
+    serie = [0] * ((d2 - d1).days + 1)
+    # Índice pelas datas ISO: linhas com data fora desse formato são ignoradas
+    posicoes = {(d1 + timedelta(days=i)).isoformat(): i for i in range(len(serie))}
+    c.execute('''SELECT data, quantidade FROM pasteis
+                 WHERE user_id = ? AND data BETWEEN ? AND ?''',
+              (user_id, d1.isoformat(), d2.isoformat()))
+    for data, quantidade in c.fetchall():
+        if data in posicoes:
+            serie[posicoes[data]] = quantidade
+    return serie
+
+def inicio_do_bucket(dia, bucket):
+    if bucket == 'week':
+        return dia - timedelta(days=dia.weekday())
+    if bucket == 'month':
+        return dia.replace(day=1)
+    return dia
+
+def maior_sequencia(serie, condicao):
+    maior = atual = 0
+    for quantidade in serie:
+        atual = atual + 1 if condicao(quantidade) else 0
+        maior = max(maior, atual)
+    return maior, atual
+
+def calcular_estatisticas(serie, d1, bucket, janela):
+    """Agrega a série diária em buckets, médias móveis, mínimo/máximo e sequências"""
+    dias = [d1 + timedelta(days=i) for i in range(len(serie))]
+
+    buckets = []
+    for _, grupo in groupby(zip(dias, serie), key=lambda par: inicio_do_bucket(par[0], bucket)):
+        grupo = list(grupo)
+        total = sum(quantidade for _, quantidade in grupo)
+        buckets.append({
+            'inicio': grupo[0][0].isoformat(),
+            'fim': grupo[-1][0].isoformat(),
+            'dias': len(grupo),
+            'total': total,
+            'media': round(total / len(grupo), 2),
+        })
+
+    # Média móvel por somas prefixadas: cada dia custa O(1), independente da janela
+    acumulado = [0, *accumulate(serie)]
+    medias_moveis = [
+        round((acumulado[i + 1] - acumulado[max(i + 1 - janela, 0)]) / min(i + 1, janela), 2)
+        for i in range(len(serie))
+    ]
+
+    i_min = min(range(len(serie)), key=serie.__getitem__)
+    i_max = max(range(len(serie)), key=serie.__getitem__)
+    maior_sem, atual_sem = maior_sequencia(serie, lambda q: q == 0)
+    maior_com, _ = maior_sequencia(serie, lambda q: q > 0)
+    total = sum(serie)
+
+    return {
+        'total': total,
+        'media': round(total / len(serie), 2),
+        'minimo': {'data': dias[i_min].isoformat(), 'quantidade': serie[i_min]},
+        'maximo': {'data': dias[i_max].isoformat(), 'quantidade': serie[i_max]},
+        'sequencias': {'maior_sem': maior_sem, 'atual_sem': atual_sem, 'maior_com': maior_com},
+        'buckets': buckets,
+        'dias': [
+            {'data': dia.isoformat(), 'quantidade': quantidade, 'media_movel': media_movel}
+            for dia, quantidade, media_movel in zip(dias, serie, medias_moveis)
+        ],
+    }
+
+def get_estatisticas(user_id, d1, d2, bucket, janela):
+    """Estatísticas do período. Só a série diária fica em cache, por (banco,
+    usuário, intervalo, versão dos dados); a agregação é refeita a cada chamada"""
+    cache = caches()
+    conn = conectar()
+    c = conn.cursor()
+    c.execute('SELECT COALESCE(MAX(versao), 0) FROM pasteis WHERE user_id = ?', (user_id,))
+    versao = c.fetchone()[0]
+    chave = (ler_banco_id(c), user_id, d1, d2, versao)
+    with cache.stats_lock:
+        serie = cache.stats.get(chave)
+        if serie is not None:
+            cache.stats.move_to_end(chave)
+    if serie is None:
+        serie = array('q', serie_diaria(c, user_id, d1, d2))
+        with cache.stats_lock:
+            cache.stats[chave] = serie
+            if len(cache.stats) > MAX_CACHE_STATS:
+                cache.stats.popitem(last=False)
     conn.close()
+    return calcular_estatisticas(serie, d1, bucket, janela)
+
+def periodo_ranking(periodo, hoje):
+    """Intervalo (inicio, fim) do período, terminando hoje"""
+    if periodo == 'semana':
+        return hoje - timedelta(days=hoje.weekday()), hoje
+    if periodo == 'mes':
+        return hoje.replace(day=1), hoje
+    return hoje, hoje
+
+def get_ranking(inicio, fim):
+    """Classificação de todos os usuários no intervalo (menos pastéis, melhor posição),
+    calculada numa única consulta e mantida em cache enquanto os meses do
+    intervalo e a lista de usuários não mudarem"""
+    cache = caches()
+    conn = conectar()
+    c = conn.cursor()
+    # As versões são lidas antes do ranking: se algo for gravado no meio, o
+    # resultado fica guardado sob a versão antiga e nunca é servido como atual
+    c.execute('SELECT mes, versao FROM versao_mes WHERE mes BETWEEN ? AND ? ORDER BY mes',
+              (inicio.isoformat()[:7], fim.isoformat()[:7]))
+    meses = tuple(c.fetchall())
+    # Usuários novos entram no ranking com zero
+    c.execute('SELECT COUNT(*), MAX(id) FROM users')
+    usuarios = c.fetchone()
+    chave = (inicio.isoformat(), fim.isoformat(), ler_banco_id(c), usuarios, meses)
+    with cache.ranking_lock:
+        if chave in cache.ranking:
+            conn.close()
+            return cache.ranking[chave]
+
+    # Usuários sem registro no período contam como zero, como os dias vazios em /media
+    c.execute('''SELECT u.username, COALESCE(t.total, 0) AS total,
+                        RANK() OVER (ORDER BY COALESCE(t.total, 0)) AS posicao,
+                        AVG(COALESCE(t.total, 0)) OVER () AS media_grupo
+                 FROM users u
+                 LEFT JOIN (SELECT user_id, SUM(quantidade) AS total FROM pasteis
+                            WHERE data BETWEEN ? AND ? GROUP BY user_id) t ON t.user_id = u.id
+                 ORDER BY posicao, u.username''', chave[:2])
+    linhas = c.fetchall()
+    conn.close()
+
+    dias = (fim - inicio).days + 1
+    ranking = {
+        'inicio': chave[0],
+        'fim': chave[1],
+        'participantes': len(linhas),
+        'media_grupo': round(linhas[0][3], 2) if linhas else 0,
+        'media_grupo_diaria': round(linhas[0][3] / dias, 2) if linhas else 0,
+        'ranking': [
+            {'posicao': posicao, 'username': username, 'total': total,
+             'media_diaria': round(total / dias, 2)}
+            for username, total, posicao, _ in linhas
+        ],
+    }
+    with cache.ranking_lock:
+        if len(cache.ranking) >= MAX_CACHE_RANKING:
+            cache.ranking.clear()
+        cache.ranking[chave] = ranking
+    return ranking
+
+def limpar_caches():
+    """Esvazia os caches em memória quando o banco é substituído"""
+    cache = caches()
+    with cache.stats_lock:
+        cache.stats.clear()
+    with cache.ranking_lock:
+        cache.ranking.clear()
 
 def check_first_run():
-    conn = sqlite3.connect('pasteis.db')
+    conn = conectar()
     c = conn.cursor()
     c.execute('SELECT COUNT(*) FROM users')
     count = c.fetchone()[0]
@@ -92,10 +412,10 @@ def check_first_run():
 
 def backup_current_db():
     """Cria backup do banco atual se existir"""
-    if os.path.exists('pasteis.db'):
+    if os.path.exists(caminho_banco()):
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_name = f'pasteis_backup_{timestamp}.db'
-        shutil.copy2('pasteis.db', backup_name)
+        shutil.copy2(caminho_banco(), os.path.join(os.path.dirname(caminho_banco()), backup_name))
         return backup_name
     return None
 
@@ -448,20 +768,209 @@ template = '''
         }
     </style>
     <script>
+        // Cópia local (IndexedDB) das contagens do usuário e fila de operações
+        // pendentes, sincronizadas em lote pelo /api/sync
+        // O nome inclui o identificador do banco do servidor: trocar o banco
+        // (upload ou novo banco) nunca reaproveita dados e fila locais antigos
+        const BANCO_ID = '{{ banco_id }}';
+        const BANCO_LOCAL = 'pasteis-' + BANCO_ID + '-{{ current_user.id }}';
+        const MAX_OPS_SYNC = {{ max_ops_sync }};  // Limite do servidor por chamada
+        let banco = null;
+        let cliente = null;
+        let sincronizando = false;
+
+        function pedido(req) {
+            return new Promise((resolve, reject) => {
+                req.onsuccess = () => resolve(req.result);
+                req.onerror = () => reject(req.error);
+            });
+        }
+
+        function concluida(tx) {
+            return new Promise((resolve, reject) => {
+                tx.oncomplete = () => resolve();
+                tx.onerror = tx.onabort = () => reject(tx.error);
+            });
+        }
+
+        function novoId() {
+            const bytes = crypto.getRandomValues(new Uint8Array(16));
+            return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+        }
+
+        // Id fixo deste navegador: junto com a chave da fila identifica cada
+        // operação, para o servidor não aplicar duas vezes o mesmo reenvio
+        function garantirCliente() {
+            const tx = banco.transaction('meta', 'readwrite');
+            const meta = tx.objectStore('meta');
+            pedido(meta.get('cliente')).then(id => {
+                cliente = id || novoId();
+                if (!id) {
+                    meta.put(cliente, 'cliente');
+                }
+            });
+            return concluida(tx);
+        }
+
+        // O servidor trocou de banco: a cópia local e a fila pertencem ao
+        // anterior e são descartadas; a página recarregada usa o novo nome
+        function descartarLocal() {
+            banco.close();
+            banco = null;
+            return pedido(indexedDB.deleteDatabase(BANCO_LOCAL)).then(() => location.reload());
+        }
+
+        function abrirBanco() {
+            if (!window.indexedDB) {
+                return Promise.reject(new Error('IndexedDB indisponível'));
+            }
+            const req = indexedDB.open(BANCO_LOCAL, 1);
+            req.onupgradeneeded = () => {
+                const db = req.result;
+                db.createObjectStore('pasteis', { keyPath: 'data' });
+                db.createObjectStore('fila', { autoIncrement: true });
+                db.createObjectStore('meta');
+            };
+            return pedido(req);
+        }
+
+        function lerLocal(data) {
+            const tx = banco.transaction('pasteis');
+            return pedido(tx.objectStore('pasteis').get(data))
+                .then(registro => registro ? registro.quantidade : undefined);
+        }
+
+        function enfileirar(acao, data, quantidade) {
+            const tx = banco.transaction(['pasteis', 'fila'], 'readwrite');
+            const pasteis = tx.objectStore('pasteis');
+            let novaQuantidade;
+            pedido(pasteis.get(data)).then(registro => {
+                const atual = registro ? registro.quantidade : Number(document.getElementById('quantidade').value) || 0;
+                novaQuantidade = acao === 'add' ? atual + quantidade : quantidade;
+                pasteis.put({ data: data, quantidade: novaQuantidade });
+                tx.objectStore('fila').add({ acao: acao, data: data, quantidade: quantidade });
+            });
+            return concluida(tx).then(() => novaQuantidade);
+        }
+
+        function mostrar(data, quantidade) {
+            if (document.getElementById('data').value !== data) {
+                return;
+            }
+            document.getElementById('quantidade').value = quantidade;
+            document.getElementById('quantidade-display').textContent = quantidade;
+        }
+
+        function sincronizar() {
+            if (!banco || sincronizando || !navigator.onLine) {
+                return Promise.resolve();
+            }
+            sincronizando = true;
+            let chaves;
+            const leitura = banco.transaction(['fila', 'meta']);
+            return Promise.all([
+                pedido(leitura.objectStore('fila').getAllKeys(null, MAX_OPS_SYNC)),
+                pedido(leitura.objectStore('fila').getAll(null, MAX_OPS_SYNC)),
+                pedido(leitura.objectStore('meta').get('versao')),
+            ]).then(([k, ops, versao]) => {
+                chaves = k;
+                const enviadas = ops.map((op, i) => Object.assign({ id: k[i] }, op));
+                return fetch('/api/sync', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ versao: versao || 0, banco: BANCO_ID, cliente: cliente, ops: enviadas }),
+                });
+            }).then(response => {
+                if (response.status === 409) {
+                    return descartarLocal().then(() => { throw new Error('Banco substituído'); });
+                }
+                if (!response.ok) {
+                    throw new Error('Falha na sincronização');
+                }
+                return response.json();
+            }).then(resposta => {
+                const tx = banco.transaction(['pasteis', 'fila', 'meta'], 'readwrite');
+                const fila = tx.objectStore('fila');
+                chaves.forEach(chave => fila.delete(chave));
+                // Dias com operações enfileiradas durante o envio mantêm o valor local
+                pedido(fila.getAll()).then(pendentes => {
+                    const datasPendentes = new Set(pendentes.map(op => op.data));
+                    resposta.alteracoes.forEach(linha => {
+                        if (!datasPendentes.has(linha.data)) {
+                            tx.objectStore('pasteis').put(linha);
+                            mostrar(linha.data, linha.quantidade);
+                        }
+                    });
+                });
+                tx.objectStore('meta').put(resposta.versao, 'versao');
+                return concluida(tx);
+            }).then(() => {
+                sincronizando = false;
+                return pedido(banco.transaction('fila').objectStore('fila').count());
+            }).then(pendentes => {
+                if (pendentes > 0) {
+                    return sincronizar();
+                }
+            }).catch(() => {
+                sincronizando = false;
+            });
+        }
+
         function atualizarQuantidade() {
             const dataInput = document.getElementById('data');
             const quantidadeInput = document.getElementById('quantidade');
-            
+            const form = document.getElementById('form-contador');
+
             dataInput.addEventListener('change', function() {
-                fetch('/get_quantidade?data=' + this.value)
+                const data = this.value;
+                if (banco) {
+                    lerLocal(data).then(quantidade => {
+                        mostrar(data, quantidade === undefined ? 0 : quantidade);
+                        sincronizar();
+                    });
+                    return;
+                }
+                fetch('/get_quantidade?data=' + data)
                     .then(response => response.json())
                     .then(data => {
                         quantidadeInput.value = data.quantidade;
                         document.getElementById('quantidade-display').textContent = data.quantidade;
                     });
             });
+
+            form.addEventListener('submit', function(event) {
+                // Sem IndexedDB o formulário segue pelo POST tradicional
+                if (!banco || !event.submitter) {
+                    return;
+                }
+                event.preventDefault();
+                const acao = event.submitter.value;
+                const data = dataInput.value;
+                const quantidade = acao === 'add' ? 1 : Math.max(Number(quantidadeInput.value) || 0, 0);
+                enfileirar(acao, data, quantidade).then(novaQuantidade => {
+                    mostrar(data, novaQuantidade);
+                    sincronizar();
+                });
+            });
+
+            abrirBanco().then(db => {
+                banco = db;
+                return garantirCliente();
+            }).then(() => {
+                const data = dataInput.value;
+                return lerLocal(data).then(quantidade => {
+                    if (quantidade !== undefined) {
+                        mostrar(data, quantidade);
+                    }
+                    return sincronizar();
+                });
+            }).catch(() => {
+                banco = null;
+            });
+
+            window.addEventListener('online', sincronizar);
         }
-        
+
         window.onload = atualizarQuantidade;
     </script>
 </head>
@@ -470,9 +979,11 @@ template = '''
         <a href="/logout" style="text-decoration:none;">Sair ({{ current_user.username }})</a>
         <span style="margin:0 8px;">|</span>
         <a href="/download_db" style="text-decoration:none;">Download do banco de dados</a>
+        <span style="margin:0 8px;">|</span>
+        <a href="/ranking" style="text-decoration:none;">Ranking</a>
     </div>
     <h2 class="center">Contador de Pastéis</h2>
-    <form method="post" action="/add">
+    <form method="post" action="/add" id="form-contador">
         <div class="form-row">
             <label for="data">Dia:</label>
             <input type="date" id="data" name="data" value="{{ data }}">
@@ -510,43 +1021,200 @@ template = '''
 </html>
 '''
 
+ranking_template = '''
+<!doctype html>
+<html lang="pt-br">
+<head>
+    <meta charset="utf-8">
+    <title>Ranking - Contador de Pastéis</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <style>
+        body { 
+            font-family: sans-serif; 
+            max-width: 400px; 
+            margin: 1em auto; 
+            background: #fafafa; 
+            padding: 0 1em;
+        }
+        .center { text-align: center; }
+        .logout { 
+            text-align: right; 
+            margin-bottom: 1em; 
+        }
+        .logout a { 
+            color: #007cba; 
+            font-size: 14px;
+        }
+        table { 
+            width: 100%; 
+            border-collapse: collapse; 
+            margin-bottom: 0.5em; 
+        }
+        th, td { 
+            padding: 0.4em; 
+            border-bottom: 1px solid #ddd; 
+            text-align: left; 
+        }
+        td.num, th.num { text-align: right; }
+        tr.eu { 
+            background: #d1ecf1; 
+            font-weight: bold; 
+        }
+        .media { 
+            margin-bottom: 2em; 
+            padding: 0.5em; 
+            background: #eee; 
+            border-radius: 8px; 
+            font-size: 14px;
+        }
+    </style>
+</head>
+<body>
+    <div class="logout">
+        <a href="/" style="text-decoration:none;">Voltar ao contador</a>
+    </div>
+    <h2 class="center">Ranking</h2>
+    <p class="center" style="font-size:14px;">Menos pastéis, melhor posição.</p>
+    {% for titulo, r in periodos %}
+    <h3>{{ titulo }}</h3>
+    {% if r.ranking %}
+    <table>
+        <tr><th>#</th><th>Usuário</th><th class="num">Total</th><th class="num">Média/dia</th></tr>
+        {% for linha in r.ranking %}
+        <tr{% if linha.username == current_user.username %} class="eu"{% endif %}>
+            <td>{{ linha.posicao }}</td>
+            <td>{{ linha.username }}</td>
+            <td class="num">{{ linha.total }}</td>
+            <td class="num">{{ linha.media_diaria }}</td>
+        </tr>
+        {% endfor %}
+    </table>
+    <div class="media center">
+        <b>Média do grupo:</b> {{ r.media_grupo }} pastéis ({{ r.media_grupo_diaria }}/dia, {{ r.participantes }} participantes)
+    </div>
+    {% else %}
+    <div class="media center">Nenhum usuário cadastrado.</div>
+    {% endif %}
+    {% endfor %}
+</body>
+</html>
+'''
+
+# Compilados pelo Jinja só no primeiro uso de cada um (ver create_app)
+TEMPLATES = {
+    'upload.html': upload_template,
+    'login.html': login_template,
+    'index.html': template,
+    'ranking.html': ranking_template,
+}
+
+# Variantes finitas das páginas de login/setup e upload (as mensagens são sempre
+# constantes): cada uma é renderizada e comprimida uma única vez, em create_app,
+# e depois servida direto dos bytes prontos
+VARIANTES_LOGIN = {
+    'login': (dict(titulo="Login", botao_texto="Entrar", primeira_vez=False),
+              (None, "Usuário ou senha incorretos")),
+    'setup': (dict(titulo="Configuração Inicial", botao_texto="Criar Usuário", primeira_vez=True),
+              (None, "As senhas não coincidem", "A senha deve ter pelo menos 4 caracteres")),
+}
+MENSAGENS_UPLOAD = (
+    None,
+    "Nenhum arquivo selecionado",
+    "Arquivo inválido. Deve ser um banco pasteis.db válido",
+    "Formato inválido. Apenas arquivos .db são aceitos",
+    "Nenhum banco atual encontrado",
+)
+
+def comprimir(corpo, codificacao, nivel_maximo=False):
+    if codificacao == 'br':
+        return brotli.compress(corpo, quality=11 if nivel_maximo else 5)
+    return gzip.compress(corpo, compresslevel=9 if nivel_maximo else 6, mtime=0)
+
+def codificacoes_disponiveis():
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+def pre_renderizar(app, template_nome, **contexto):
+    """Renderiza o template e guarda o corpo cru e em cada codificação suportada"""
+    corpo = app.jinja_env.get_template(template_nome).render(**contexto).encode('utf-8')
+    variantes = {'identity': corpo}
+    for codificacao in codificacoes_disponiveis():
+        variantes[codificacao] = comprimir(corpo, codificacao, nivel_maximo=True)
+    return variantes
+
+def pre_renderizar_paginas(app):
+    paginas = {}
+    for modo, (contexto, mensagens) in VARIANTES_LOGIN.items():
+        for mensagem in mensagens:
+            paginas[('login', modo, mensagem)] = pre_renderizar(app, 'login.html', mensagem=mensagem, **contexto)
+    for tem_banco_atual in (False, True):
+        for mensagem in MENSAGENS_UPLOAD:
+            paginas[('upload', tem_banco_atual, mensagem)] = pre_renderizar(
+                app, 'upload.html', mensagem=mensagem, tipo_msg="error" if mensagem else None,
+                tem_banco_atual=tem_banco_atual)
+    return paginas
+
+def responder_pre_renderizada(chave):
+    """Escolhe a variante conforme o Accept-Encoding do cliente"""
+    variantes = current_app.extensions['contador_paginas'][chave]
+    codificacao = request.accept_encodings.best_match(codificacoes_disponiveis())
+    response = Response(variantes[codificacao or 'identity'], mimetype='text/html')
+    if codificacao:
+        response.headers['Content-Encoding'] = codificacao
+    response.vary.add('Accept-Encoding')
+    return response
+
+def pagina_login(modo, mensagem=None):
+    return responder_pre_renderizada(('login', modo, mensagem))
+
+def pagina_upload(tem_banco_atual, mensagem=None):
+    return responder_pre_renderizada(('upload', tem_banco_atual, mensagem))
+
+@bp.after_app_request
+def comprimir_resposta(response):
+    """Comprime respostas dinâmicas de HTML/JSON quando o cliente aceita"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in ('text/html', 'application/json')):
+        return response
+    response.vary.add('Accept-Encoding')
+    codificacao = request.accept_encodings.best_match(codificacoes_disponiveis())
+    corpo = response.get_data()
+    if codificacao and len(corpo) >= MIN_BYTES_COMPRESSAO:
+        response.set_data(comprimir(corpo, codificacao))
+        response.headers['Content-Encoding'] = codificacao
+    return response
+
 def get_quantidade(d):
     return pasteis_por_dia.get(d, 0)
 
 def get_quantidade(data):
     if not current_user.is_authenticated:
         return 0
-    conn = sqlite3.connect('pasteis.db')
+    conn = conectar()
     c = conn.cursor()
     c.execute('SELECT quantidade FROM pasteis WHERE data = ? AND user_id = ?', (data, current_user.id))
     result = c.fetchone()
     conn.close()
     return result[0] if result else 0
 
-@app.route('/upload_db', methods=['GET', 'POST'])
+@bp.route('/upload_db', methods=['GET', 'POST'])
 def upload_db():
-    tem_banco_atual = os.path.exists('pasteis.db')
+    tem_banco_atual = os.path.exists(caminho_banco())
     
     if request.method == 'POST':
         acao = request.form.get('acao')
         
         if acao == 'upload':
             if 'database_file' not in request.files:
-                return render_template_string(upload_template, 
-                                            mensagem="Nenhum arquivo selecionado",
-                                            tipo_msg="error",
-                                            tem_banco_atual=tem_banco_atual)
+                return pagina_upload(tem_banco_atual, "Nenhum arquivo selecionado")
             
             file = request.files['database_file']
             if file.filename == '':
-                return render_template_string(upload_template, 
-                                            mensagem="Nenhum arquivo selecionado",
-                                            tipo_msg="error",
-                                            tem_banco_atual=tem_banco_atual)
+                return pagina_upload(tem_banco_atual, "Nenhum arquivo selecionado")
             
             if file and file.filename.lower().endswith('.db'):
                 # Salva temporariamente para validar
-                temp_filename = 'temp_upload.db'
+                temp_filename = os.path.join(os.path.dirname(caminho_banco()), 'temp_upload.db')
                 file.save(temp_filename)
                 
                 # Valida o arquivo
@@ -555,9 +1223,11 @@ def upload_db():
                     backup_name = backup_current_db()
                     
                     # Substitui o banco atual
-                    if os.path.exists('pasteis.db'):
-                        os.remove('pasteis.db')
-                    shutil.move(temp_filename, 'pasteis.db')
+                    if os.path.exists(caminho_banco()):
+                        os.remove(caminho_banco())
+                    shutil.move(temp_filename, caminho_banco())
+                    init_db(novo_banco=True)  # Aplica migrações no banco enviado
+                    limpar_caches()
                     
                     mensagem = "Banco de dados carregado com sucesso!"
                     if backup_name:
@@ -565,70 +1235,59 @@ def upload_db():
                     
                     # Redireciona para verificar se precisa de setup ou login
                     if check_first_run():
-                        return redirect(url_for('setup'))
+                        return redirect(url_for('.setup'))
                     else:
                         flash("Banco de dados carregado com sucesso!")
-                        return redirect(url_for('login'))
+                        return redirect(url_for('.login'))
                 else:
                     os.remove(temp_filename)
-                    return render_template_string(upload_template, 
-                                                mensagem="Arquivo inválido. Deve ser um banco pasteis.db válido",
-                                                tipo_msg="error",
-                                                tem_banco_atual=tem_banco_atual)
+                    return pagina_upload(tem_banco_atual, "Arquivo inválido. Deve ser um banco pasteis.db válido")
             else:
-                return render_template_string(upload_template, 
-                                            mensagem="Formato inválido. Apenas arquivos .db são aceitos",
-                                            tipo_msg="error",
-                                            tem_banco_atual=tem_banco_atual)
+                return pagina_upload(tem_banco_atual, "Formato inválido. Apenas arquivos .db são aceitos")
         
         elif acao == 'usar_atual':
             if tem_banco_atual:
                 if check_first_run():
-                    return redirect(url_for('setup'))
+                    return redirect(url_for('.setup'))
                 else:
                     flash("Continuando com o banco atual")
-                    return redirect(url_for('login'))
+                    return redirect(url_for('.login'))
             else:
-                return render_template_string(upload_template, 
-                                            mensagem="Nenhum banco atual encontrado",
-                                            tipo_msg="error",
-                                            tem_banco_atual=tem_banco_atual)
+                return pagina_upload(tem_banco_atual, "Nenhum banco atual encontrado")
         
         elif acao == 'criar_novo':
             # Faz backup do banco atual se existir
             backup_name = backup_current_db()
             
             # Remove banco atual e cria novo
-            if os.path.exists('pasteis.db'):
-                os.remove('pasteis.db')
-            init_db()
+            if os.path.exists(caminho_banco()):
+                os.remove(caminho_banco())
+            init_db(novo_banco=True)
+            limpar_caches()
             
             mensagem = "Novo banco criado!"
             if backup_name:
                 mensagem += f" Backup do anterior: {backup_name}"
             
-            return redirect(url_for('setup'))
+            return redirect(url_for('.setup'))
     
-    return render_template_string(upload_template, 
-                                mensagem=None,
-                                tipo_msg=None,
-                                tem_banco_atual=tem_banco_atual)
+    return pagina_upload(tem_banco_atual)
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     # Verifica se é a primeira execução ou se não existe banco
-    if not os.path.exists('pasteis.db'):
-        return redirect(url_for('upload_db'))
+    if not os.path.exists(caminho_banco()):
+        return redirect(url_for('.upload_db'))
     
     # Se existe banco mas é primeira execução (sem usuários), vai para setup
     if check_first_run():
-        return redirect(url_for('setup'))
+        return redirect(url_for('.setup'))
     
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         
-        conn = sqlite3.connect('pasteis.db')
+        conn = conectar()
         c = conn.cursor()
         c.execute('SELECT id, username, password_hash FROM users WHERE username = ?', (username,))
         user = c.fetchone()
@@ -637,34 +1296,26 @@ def login():
         if user and check_password_hash(user[2], password):
             user_obj = User(user[0], user[1])
             login_user(user_obj)
-            return redirect(url_for('index'))
+            return redirect(url_for('.index'))
         else:
-            return render_template_string(login_template, 
-                                        titulo="Login", 
-                                        botao_texto="Entrar",
-                                        primeira_vez=False,
-                                        mensagem="Usuário ou senha incorretos")
+            return pagina_login('login', "Usuário ou senha incorretos")
     
-    return render_template_string(login_template, 
-                                titulo="Login", 
-                                botao_texto="Entrar",
-                                primeira_vez=False,
-                                mensagem=None)
+    return pagina_login('login')
 
-@app.route('/db_manager')
+@bp.route('/db_manager')
 def db_manager():
     """Rota para gerenciar banco de dados quando já existe um"""
-    return redirect(url_for('upload_db'))
+    return redirect(url_for('.upload_db'))
 
-@app.route('/setup', methods=['GET', 'POST'])
+@bp.route('/setup', methods=['GET', 'POST'])
 def setup():
     # Se não existe banco, redireciona para upload
-    if not os.path.exists('pasteis.db'):
-        return redirect(url_for('upload_db'))
+    if not os.path.exists(caminho_banco()):
+        return redirect(url_for('.upload_db'))
     
     # Se já existe usuário, redireciona para login
     if not check_first_run():
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     
     if request.method == 'POST':
         username = request.form['username']
@@ -672,21 +1323,13 @@ def setup():
         confirm_password = request.form['confirm_password']
         
         if password != confirm_password:
-            return render_template_string(login_template, 
-                                        titulo="Configuração Inicial", 
-                                        botao_texto="Criar Usuário",
-                                        primeira_vez=True,
-                                        mensagem="As senhas não coincidem")
+            return pagina_login('setup', "As senhas não coincidem")
         
         if len(password) < 4:
-            return render_template_string(login_template, 
-                                        titulo="Configuração Inicial", 
-                                        botao_texto="Criar Usuário",
-                                        primeira_vez=True,
-                                        mensagem="A senha deve ter pelo menos 4 caracteres")
+            return pagina_login('setup', "A senha deve ter pelo menos 4 caracteres")
         
         # Cria o primeiro usuário
-        conn = sqlite3.connect('pasteis.db')
+        conn = conectar()
         c = conn.cursor()
         password_hash = generate_password_hash(password)
         c.execute('INSERT INTO users (username, password_hash) VALUES (?, ?)', 
@@ -694,29 +1337,25 @@ def setup():
         conn.commit()
         conn.close()
         
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     
-    return render_template_string(login_template, 
-                                titulo="Configuração Inicial", 
-                                botao_texto="Criar Usuário",
-                                primeira_vez=True,
-                                mensagem=None)
+    return pagina_login('setup')
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
-@app.route('/', methods=['GET'])
+@bp.route('/', methods=['GET'])
 @login_required
 def index():
     hoje = date.today().isoformat()
     data = request.args.get('data', hoje)
     quantidade = get_quantidade(data)
-    return render_template_string(template, data=data, quantidade=quantidade, inicio=hoje, fim=hoje, media=None)
+    return render_template('index.html', data=data, quantidade=quantidade, inicio=hoje, fim=hoje, media=None, max_ops_sync=MAX_OPS_SYNC, banco_id=get_banco_id())
 
-@app.route('/add', methods=['POST'])
+@bp.route('/add', methods=['POST'])
 @login_required
 def add():
     data = request.form.get('data', date.today().isoformat())
@@ -726,11 +1365,12 @@ def add():
     except ValueError:
         quantidade = 0
     if acao == 'add':
-        quantidade = get_quantidade(data) + 1
-    set_quantidade(data, quantidade)
-    return redirect(url_for('index', data=data))
+        set_quantidade(data, 1, acao='add')
+    else:
+        set_quantidade(data, quantidade)
+    return redirect(url_for('.index', data=data))
 
-@app.route('/media', methods=['GET'])
+@bp.route('/media', methods=['GET'])
 @login_required
 def media():
     inicio = request.args.get('inicio', date.today().isoformat())
@@ -745,26 +1385,100 @@ def media():
     dias = (d2 - d1).days + 1
     
     # Busca dados do banco
-    conn = sqlite3.connect('pasteis.db')
+    conn = conectar()
     c = conn.cursor()
-    c.execute('''SELECT data, quantidade FROM pasteis 
-                 WHERE data BETWEEN ? AND ? AND user_id = ?''', 
-              (d1.isoformat(), d2.isoformat(), current_user.id))
-    dados = {row[0]: row[1] for row in c.fetchall()}
+    serie = serie_diaria(c, current_user.id, d1, d2)
     conn.close()
     
-    total = sum(dados.get((d1 + timedelta(days=i)).isoformat(), 0) for i in range(dias))
+    total = sum(serie)
     media = round(total / dias, 2) if dias > 0 else 0
-    return render_template_string(template, data=d2.isoformat(), quantidade=get_quantidade(d2.isoformat()), inicio=inicio, fim=fim, media=media)
+    return render_template('index.html', data=d2.isoformat(), quantidade=get_quantidade(d2.isoformat()), inicio=inicio, fim=fim, media=media, max_ops_sync=MAX_OPS_SYNC, banco_id=get_banco_id())
+
+@bp.route('/api/stats', methods=['GET'])
+@login_required
+def api_stats():
+    """Totais e médias por dia/semana/mês, médias móveis, mínimo/máximo e sequências"""
+    hoje = date.today().isoformat()
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in ('day', 'week', 'month'):
+        return {'erro': 'bucket deve ser day, week ou month'}, 400
+    try:
+        d1 = datetime.strptime(request.args.get('inicio', hoje), '%Y-%m-%d').date()
+        d2 = datetime.strptime(request.args.get('fim', hoje), '%Y-%m-%d').date()
+        janela = int(request.args.get('window', 7))
+    except ValueError:
+        return {'erro': 'Parâmetros inválidos'}, 400
+    if d1 > d2:
+        d1, d2 = d2, d1
+    if (d2 - d1).days + 1 > MAX_DIAS_STATS:
+        return {'erro': f'Intervalo máximo de {MAX_DIAS_STATS} dias'}, 400
+    if not 1 <= janela <= MAX_DIAS_STATS:
+        return {'erro': 'window inválido'}, 400
+    estatisticas = get_estatisticas(current_user.id, d1, d2, bucket, janela)
+    return {'inicio': d1.isoformat(), 'fim': d2.isoformat(), 'bucket': bucket,
+            'window': janela, **estatisticas}
+
+@bp.route('/ranking', methods=['GET'])
+@login_required
+def ranking():
+    hoje = date.today()
+    periodos = [(titulo, get_ranking(*periodo_ranking(periodo, hoje)))
+                for titulo, periodo in (('Hoje', 'hoje'), ('Esta semana', 'semana'), ('Este mês', 'mes'))]
+    return render_template('ranking.html', periodos=periodos)
+
+@bp.route('/api/ranking', methods=['GET'])
+@login_required
+def api_ranking():
+    periodo = request.args.get('periodo', 'hoje')
+    if periodo not in ('hoje', 'semana', 'mes'):
+        return {'erro': 'periodo deve ser hoje, semana ou mes'}, 400
+    return {'periodo': periodo, **get_ranking(*periodo_ranking(periodo, date.today()))}
 
-@app.route('/get_quantidade', methods=['GET'])
+@bp.route('/get_quantidade', methods=['GET'])
 @login_required
 def get_quantidade_ajax():
     data = request.args.get('data', date.today().isoformat())
     quantidade = get_quantidade(data)
     return {'quantidade': quantidade}
 
-@app.route('/download_db')
+@bp.route('/api/sync', methods=['POST'])
+@login_required
+def api_sync():
+    """Recebe a fila de operações offline do cliente e devolve o delta desde sua versão"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return {'erro': 'JSON inválido'}, 400
+    try:
+        versao_cliente = int(payload.get('versao', 0))
+        cliente = payload.get('cliente')
+        if cliente is not None and not (isinstance(cliente, str) and 0 < len(cliente) <= 64):
+            raise ValueError(cliente)
+        banco = payload.get('banco')
+        if banco is not None and not isinstance(banco, str):
+            raise ValueError(banco)
+        ops = []
+        for op in payload.get('ops') or []:
+            acao = op.get('acao')
+            if acao not in ('add', 'set'):
+                raise ValueError(acao)
+            data = datetime.strptime(op['data'], '%Y-%m-%d').date().isoformat()
+            quantidade = int(op.get('quantidade', 1 if acao == 'add' else 0))
+            if acao == 'set' and quantidade < 0:
+                raise ValueError(quantidade)
+            op_id = op.get('id')
+            if op_id is not None:
+                op_id = int(op_id)
+            ops.append({'id': op_id, 'acao': acao, 'data': data, 'quantidade': quantidade})
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return {'erro': 'Operação inválida'}, 400
+    if len(ops) > MAX_OPS_SYNC:
+        return {'erro': f'Máximo de {MAX_OPS_SYNC} operações por sincronização'}, 400
+    resultado = sincronizar(current_user.id, versao_cliente, ops, cliente, banco)
+    if banco is not None and resultado['banco'] != banco:
+        return {'erro': 'O banco foi substituído', 'banco': resultado['banco']}, 409
+    return resultado
+
+@bp.route('/download_db')
 @login_required
 def download_db():
     # Fecha conexões SQLite antes do download
@@ -773,13 +1487,48 @@ def download_db():
         gc.collect()
     except Exception:
         pass
-    db_path = 'pasteis.db'
+    db_path = os.path.abspath(caminho_banco())
     return send_file(db_path, as_attachment=True, download_name=f"pasteis_{int(time.time())}.db")
 
+def inicializar_banco(app):
+    """Garante schema e migrações uma vez por processo; a trava em arquivo
+    serializa os workers que sobem ao mesmo tempo"""
+    caminho = os.path.abspath(app.config['DATABASE'])
+    with _bancos_inicializados_lock:
+        # Sem banco, o usuário é levado ao upload, que cria ou envia um
+        if caminho in _bancos_inicializados or not os.path.exists(caminho):
+            return
+        with open(caminho + '.lock', 'w') as trava:
+            if fcntl:
+                fcntl.flock(trava, fcntl.LOCK_EX)
+            with app.app_context():
+                init_db()
+        _bancos_inicializados.add(caminho)
+
+def create_app(config=None):
+    inicio = time.perf_counter()
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY='sua-chave-secreta-aqui-mude-em-producao',
+        MAX_CONTENT_LENGTH=16 * 1024 * 1024,  # 16MB max file size
+        # Caminho compartilhado com o asgi.py, que cria o app sem configuração
+        DATABASE=os.environ.get('PASTEIS_DB', 'pasteis.db'),
+    )
+    if config:
+        app.config.update(config)
+
+    app.jinja_loader = DictLoader(TEMPLATES)
+    app.extensions['contador_caches'] = Caches()
+    app.extensions['contador_paginas'] = pre_renderizar_paginas(app)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    inicializar_banco(app)
+
+    app.logger.debug('Aplicação criada em %.1f ms', (time.perf_counter() - inicio) * 1000)
+    return app
+
 if __name__ == '__main__':
-    # Verifica se existe banco, se não redireciona para upload
-    if os.path.exists('pasteis.db'):
-        init_db()  # Garante que as tabelas existem
+    app = create_app()
     
     # Porta configurável via variável de ambiente (equivalente ao Node.js)
     port = int(os.environ.get('PORT', 10000))
@@ -0,0 +1,224 @@
+"""API assíncrona (ASGI) para leitura e incremento do contador.
+
+Roda ao lado do app Flask, usando o mesmo banco e o mesmo cookie de sessão:
+quem fez login no app Flask já está autenticado aqui. Conexões ociosas
+(keep-alive) custam só uma corrotina, não uma thread. O caminho do banco vem
+da variável PASTEIS_DB (padrão: pasteis.db), a mesma lida pelo create_app.
+
+    PASTEIS_DB=/srv/pasteis/pasteis.db uvicorn asgi:app --port 10001
+
+Rotas (o proxy reverso encaminha /api/quantidade e /api/add para cá):
+    GET  /api/quantidade?data=AAAA-MM-DD  -> {"quantidade": n}
+    POST /api/add  {"data", "acao": "add"|"set", "quantidade"}  -> {"quantidade": n}
+"""
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from urllib.parse import parse_qs
+import sqlite3
+
+from itsdangerous import BadSignature
+from werkzeug.http import parse_cookie
+
+from app import aplicar_operacao, create_app, proxima_versao
+
+MAX_CORPO = 4096  # Bytes aceitos no corpo do POST /api/add
+MAX_LOTE_ESCRITA = 200  # Incrementos gravados por transação pelo escritor
+
+# Leituras vão para um pool pequeno; escritas passam todas por um único escritor
+_executor_leitura = ThreadPoolExecutor(max_workers=4, thread_name_prefix='sqlite-leitura')
+_executor_escrita = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-escrita')
+_fila_escrita = None
+_tarefa_escritor = None
+
+flask_app = create_app()
+_banco = flask_app.config['DATABASE']
+
+_serializador = flask_app.session_interface.get_signing_serializer(flask_app)
+_cookie_sessao = flask_app.config['SESSION_COOKIE_NAME']
+_validade_sessao = int(flask_app.permanent_session_lifetime.total_seconds())
+
+def usuario_da_sessao(scope):
+    """Id do usuário gravado pelo Flask-Login no cookie de sessão do Flask"""
+    for nome, valor in scope['headers']:
+        if nome == b'cookie':
+            cookie = parse_cookie(valor.decode('latin-1')).get(_cookie_sessao)
+            if not cookie:
+                return None
+            try:
+                sessao = _serializador.loads(cookie, max_age=_validade_sessao)
+            except BadSignature:
+                return None
+            return sessao.get('_user_id')
+    return None
+
+def ler_quantidade(user_id, data):
+    """Executado no pool de leitura: valida o usuário e lê a quantidade numa só conexão"""
+    conn = sqlite3.connect(_banco)
+    c = conn.cursor()
+    c.execute('SELECT 1 FROM users WHERE id = ?', (user_id,))
+    if not c.fetchone():
+        conn.close()
+        return None
+    c.execute('SELECT quantidade FROM pasteis WHERE data = ? AND user_id = ?', (data, user_id))
+    result = c.fetchone()
+    conn.close()
+    return result[0] if result else 0
+
+def gravar_lote(lote):
+    """Executado na thread do escritor: aplica o lote inteiro numa única transação"""
+    conn = sqlite3.connect(_banco, isolation_level=None)
+    c = conn.cursor()
+    resultados = []
+    try:
+        c.execute('BEGIN IMMEDIATE')
+        versoes = {}
+        for user_id, data, acao, quantidade in lote:
+            c.execute('SELECT 1 FROM users WHERE id = ?', (user_id,))
+            if not c.fetchone():
+                resultados.append(None)
+                continue
+            if user_id not in versoes:
+                versoes[user_id] = proxima_versao(c, user_id)
+            resultados.append(aplicar_operacao(c, user_id, data, acao, quantidade, versoes[user_id]))
+        c.execute('COMMIT')
+    except Exception:
+        c.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    return resultados
+
+async def gravar_pedidos(loop, pedidos):
+    try:
+        resultados = await loop.run_in_executor(
+            _executor_escrita, gravar_lote, [operacao for operacao, _ in pedidos])
+    except Exception as erro:
+        for _, futuro in pedidos:
+            # Pedidos cancelados (cliente desconectou) já têm o futuro resolvido
+            if not futuro.done():
+                futuro.set_exception(erro)
+    else:
+        for (_, futuro), resultado in zip(pedidos, resultados):
+            if not futuro.done():
+                futuro.set_result(resultado)
+
+async def escritor():
+    """Tarefa única que drena a fila e grava os pedidos acumulados de uma vez"""
+    loop = asyncio.get_running_loop()
+    while True:
+        pedidos = [await _fila_escrita.get()]
+        while len(pedidos) < MAX_LOTE_ESCRITA and not _fila_escrita.empty():
+            pedidos.append(_fila_escrita.get_nowait())
+        # Nenhuma falha de um lote pode encerrar a tarefa: ela é o único escritor
+        try:
+            await gravar_pedidos(loop, pedidos)
+        except Exception:
+            flask_app.logger.exception('Falha ao gravar lote de %d pedidos', len(pedidos))
+        finally:
+            for _ in pedidos:
+                _fila_escrita.task_done()
+
+async def encerrar_escritor():
+    """Grava o que ainda está na fila, para o escritor e libera as threads sem
+    bloquear o loop de eventos"""
+    if _tarefa_escritor is not None:
+        await _fila_escrita.join()
+        _tarefa_escritor.cancel()
+        try:
+            await _tarefa_escritor
+        except asyncio.CancelledError:
+            pass
+    _executor_leitura.shutdown(wait=False)
+    _executor_escrita.shutdown(wait=False)
+
+async def enfileirar_escrita(operacao):
+    global _fila_escrita, _tarefa_escritor
+    if _fila_escrita is None:
+        _fila_escrita = asyncio.Queue()
+        _tarefa_escritor = asyncio.get_running_loop().create_task(escritor())
+    futuro = asyncio.get_running_loop().create_future()
+    await _fila_escrita.put((operacao, futuro))
+    return await futuro
+
+async def responder(send, status, corpo):
+    dados = json.dumps(corpo).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(dados)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': dados})
+
+async def ler_corpo(receive):
+    corpo = b''
+    while True:
+        mensagem = await receive()
+        corpo += mensagem.get('body', b'')
+        if len(corpo) > MAX_CORPO:
+            return None
+        if not mensagem.get('more_body'):
+            return corpo
+
+def validar_data(valor):
+    return datetime.strptime(valor, '%Y-%m-%d').date().isoformat()
+
+async def api_quantidade(scope, receive, send, user_id):
+    args = parse_qs(scope['query_string'].decode('latin-1'))
+    try:
+        data = validar_data(args.get('data', [date.today().isoformat()])[0])
+    except ValueError:
+        return await responder(send, 400, {'erro': 'Data inválida'})
+    quantidade = await asyncio.get_running_loop().run_in_executor(
+        _executor_leitura, ler_quantidade, user_id, data)
+    if quantidade is None:
+        return await responder(send, 401, {'erro': 'Não autenticado'})
+    await responder(send, 200, {'quantidade': quantidade})
+
+async def api_add(scope, receive, send, user_id):
+    corpo = await ler_corpo(receive)
+    if corpo is None:
+        return await responder(send, 413, {'erro': f'Corpo maior que {MAX_CORPO} bytes'})
+    try:
+        payload = json.loads(corpo)
+        data = validar_data(payload.get('data', date.today().isoformat()))
+        acao = payload.get('acao', 'add')
+        if acao not in ('add', 'set'):
+            raise ValueError(acao)
+        quantidade = int(payload.get('quantidade', 1 if acao == 'add' else 0))
+        if quantidade < 0:
+            raise ValueError(quantidade)
+    except (AttributeError, TypeError, ValueError):
+        return await responder(send, 400, {'erro': 'Operação inválida'})
+    resultado = await enfileirar_escrita((user_id, data, acao, quantidade))
+    if resultado is None:
+        return await responder(send, 401, {'erro': 'Não autenticado'})
+    await responder(send, 200, {'quantidade': resultado})
+
+ROTAS = {
+    ('GET', '/api/quantidade'): api_quantidade,
+    ('POST', '/api/add'): api_add,
+}
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            mensagem = await receive()
+            if mensagem['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensagem['type'] == 'lifespan.shutdown':
+                await encerrar_escritor()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    rota = ROTAS.get((scope['method'], scope['path']))
+    if rota is None:
+        return await responder(send, 404, {'erro': 'Rota não encontrada'})
+    user_id = usuario_da_sessao(scope)
+    if user_id is None:
+        return await responder(send, 401, {'erro': 'Não autenticado'})
+    await rota(scope, receive, send, user_id)
@@ -0,0 +1,59 @@
+from array import array
+from datetime import date
+
+from app import calcular_estatisticas
+
+# 2026-10-14 é uma quarta-feira; a semana seguinte começa na segunda 2026-10-19
+SERIE = [0, 3, 0, 0, 2, 5, 0]
+INICIO = date(2026, 10, 14)
+
+
+def test_buckets_semanais_parciais_nas_bordas():
+    buckets = calcular_estatisticas(SERIE, INICIO, 'week', 7)['buckets']
+    assert buckets == [
+        {'inicio': '2026-10-14', 'fim': '2026-10-18', 'dias': 5, 'total': 5, 'media': 1.0},
+        {'inicio': '2026-10-19', 'fim': '2026-10-20', 'dias': 2, 'total': 5, 'media': 2.5},
+    ]
+
+
+def test_buckets_mensais_na_virada_do_mes():
+    buckets = calcular_estatisticas([1, 2, 3, 4], date(2026, 9, 29), 'month', 7)['buckets']
+    assert buckets == [
+        {'inicio': '2026-09-29', 'fim': '2026-09-30', 'dias': 2, 'total': 3, 'media': 1.5},
+        {'inicio': '2026-10-01', 'fim': '2026-10-02', 'dias': 2, 'total': 7, 'media': 3.5},
+    ]
+
+
+def test_buckets_diarios():
+    buckets = calcular_estatisticas(SERIE, INICIO, 'day', 7)['buckets']
+    assert [b['total'] for b in buckets] == SERIE
+    assert all(b['inicio'] == b['fim'] and b['dias'] == 1 for b in buckets)
+
+
+def test_media_movel_com_janela_parcial_no_inicio():
+    dias = calcular_estatisticas(SERIE, INICIO, 'day', 3)['dias']
+    # Os dois primeiros dias dividem só pelos dias já disponíveis
+    assert [d['media_movel'] for d in dias] == [0.0, 1.5, 1.0, 1.0, 0.67, 2.33, 2.33]
+    assert dias[0] == {'data': '2026-10-14', 'quantidade': 0, 'media_movel': 0.0}
+
+
+def test_janela_maior_que_a_serie():
+    dias = calcular_estatisticas([2, 4], INICIO, 'day', 30)['dias']
+    assert [d['media_movel'] for d in dias] == [2.0, 3.0]
+
+
+def test_sequencias():
+    assert calcular_estatisticas(SERIE, INICIO, 'day', 7)['sequencias'] == {
+        'maior_sem': 2, 'atual_sem': 1, 'maior_com': 2,
+    }
+    assert calcular_estatisticas([0, 0, 0, 1, 1, 1, 1, 0, 2], INICIO, 'day', 7)['sequencias'] == {
+        'maior_sem': 3, 'atual_sem': 0, 'maior_com': 4,
+    }
+
+
+def test_totais_minimo_e_maximo():
+    estatisticas = calcular_estatisticas(array('q', SERIE), INICIO, 'day', 7)
+    assert estatisticas['total'] == 10
+    assert estatisticas['media'] == 1.43
+    assert estatisticas['minimo'] == {'data': '2026-10-14', 'quantidade': 0}
+    assert estatisticas['maximo'] == {'data': '2026-10-19', 'quantidade': 5}
@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importar_nao_cria_app_nem_banco(tmp_path):
+    """Importar app.py só define funções: nenhum banco ou trava é criado e o
+    tempo próprio do módulo (sem Flask e demais dependências) fica baixo"""
+    ambiente = dict(os.environ, PYTHONPATH=RAIZ, PYTHONDONTWRITEBYTECODE='1')
+    ambiente.pop('PASTEIS_DB', None)
+    resultado = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                               cwd=tmp_path, env=ambiente, capture_output=True, text=True, check=True)
+
+    linha = next(linha for linha in resultado.stderr.splitlines() if linha.endswith('| app'))
+    tempo_proprio_us = int(linha.split(':')[1].split('|')[0])
+    assert tempo_proprio_us < 100_000
+
+    assert list(tmp_path.iterdir()) == []